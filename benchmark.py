@@ -1,13 +1,19 @@
 import logging
+from statistics import geometric_mean
 from multiprocessing import Process, Queue
+from concurrent.futures import ThreadPoolExecutor
 from connection import Connection
 from replica import Replica
+from index import Index
 from query_stream import QueryStream
 
 from tpc_const import QS_ORDER
 
+# how long to wait (in seconds) for each stream's timing data once the tests have finished
+RESULT_TIMEOUT = 30
+
 class Benchmark:
-    def __init__(self, queries: list[str], rf1_data, rf2_data, replicas: list[Replica], routes: list[int], indexes: list[list[str, list[str]]], n_query_streams: int, scale_factor: int):
+    def __init__(self, queries: list[str], rf1_data, rf2_data, replicas: list[Replica], routes: list[int], indexes: list[list[Index]], n_query_streams: int, scale_factor: int):
         self.queries = queries
         self.replicas = replicas
         self.routes = routes
@@ -27,21 +33,55 @@ class Benchmark:
     
     def _create_indexes(self):
         logging.info('creating indexes!')
-        connections = [Connection(replica) for replica in self.replicas]
-        cursors = [c.conn().cursor() for c in connections]
-
+        jobs = []
         indexes_created = 0
 
-        for i_rep, config in enumerate(self.indexes):
-            cur = cursors[i_rep]
-            for index in config:
-                indexes_created += 1
-                cur.execute(f'CREATE INDEX idx_{indexes_created} ON {index[0]} ({','.join(index[1])})')
-        
-        for cur in cursors:
-            cur.close()
-        for conn in connections:
-            conn.close()
+        # the index builds run on the server, so a thread per replica is enough
+        # to overlap them. `result` re-raises a failed build, so the benchmark
+        # never runs without the configured indexes
+        with ThreadPoolExecutor(max_workers=max(len(self.replicas), 1)) as executor:
+            for i_rep, config in enumerate(self.indexes):
+                statements = []
+                for index in config:
+                    indexes_created += 1
+                    name = f'idx_{indexes_created}'
+                    # an index left behind by an earlier run is rebuilt, not kept
+                    statements.append(f'DROP INDEX IF EXISTS {name}')
+                    statements.append(f'CREATE INDEX {name} ON {index.table} ({index.columns})')
+                jobs.append(executor.submit(self._create_replica_indexes, self.replicas[i_rep], statements))
+
+            for job in jobs:
+                job.result()
+
+    def _create_replica_indexes(self, replica: Replica, statements: list[str]):
+        '''
+        Builds every index in the configuration for a single replica.
+
+        Indexes are built with a plain `CREATE INDEX`, not `CONCURRENTLY`:
+        nothing else is querying the tables yet (this runs before any stream
+        starts), and a concurrent build scans the table twice. Each statement is
+        executed on its own using the autocommit connection, and each replica is
+        handled by its own thread so that the index builds on different replicas
+        overlap.
+
+        This must only be called once the table data has been loaded
+        (`Generator.load_database`) -- building the index after the bulk load
+        is much cheaper than maintaining it during the COPY.
+
+        :param replica: the replica to build the indexes on
+        :param statements: the `DROP INDEX` and `CREATE INDEX` statements for this replica
+        '''
+        if not statements:
+            return
+
+        connection = Connection(replica)
+
+        try:
+            with connection.conn().cursor() as cur:
+                for statement in statements:
+                    cur.execute(statement)
+        finally:
+            connection.close()
     
     def run_power_test(self):
         logging.info('starting power test...')
@@ -62,15 +102,9 @@ class Benchmark:
             process.join()
     
     def _power_result(self, qi0, ri0):
-        query_res = 1
-        refresh_res = 1
-
-        for query_time in qi0:
-            query_res = query_res * query_time
-        for refresh_time in ri0:
-            refresh_res = refresh_res * refresh_time
-        
-        return (3600 * self.scale_factor) / pow(query_res * refresh_res, 1/24)
+        # the geometric mean is computed in the log domain, so the product of
+        # the 24 timing intervals can't overflow or underflow
+        return (3600 * self.scale_factor) / geometric_mean(qi0 + ri0)
     
     def _throughput_result(self, ts):
         return (self.n_query_streams * 22 * 3600 * self.scale_factor) / ts
@@ -87,10 +121,9 @@ class Benchmark:
         power_result = None
         throughput_results = []
 
-        while True:
-            if self.timer_queue.empty():
-                break
-            result = self.timer_queue.get()
+        # one result from the power stream, each of the throughput streams, and the refresh stream
+        for _ in range(self.n_query_streams + 2):
+            result = self.timer_queue.get(timeout=RESULT_TIMEOUT)
 
             if result['mode'] == 'power':
                 power_result = result
@@ -1,9 +1,57 @@
-import psycopg
+import os
 import logging
+import psycopg
+from psycopg_pool import ConnectionPool
 from replica import Replica
 
+# refresh function #1 needs two connections to the same replica at once
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 4
+
+# pools are keyed by (pid, connection string): see `get_pool`
+_pools: dict[tuple[int, str], ConnectionPool] = {}
+
+def get_pool(replica: Replica) -> ConnectionPool:
+    '''
+    Returns the connection pool for a replica, creating it the first time
+    it is requested in the current process.
+
+    psycopg connections can't be shared across a fork, so each process keeps
+    its own pools. Any pools inherited from the parent process are keyed
+    by the parent's pid and are never handed out in the child.
+
+    A pool runs its own background threads, so pools must only be opened in
+    worker processes that never fork themselves (see `Connection`).
+
+    :param replica: the database `Replica` we want connections to
+    :returns: the pool of connections to that replica in this process
+    '''
+    key = (os.getpid(), replica.connection_string)
+
+    if key not in _pools:
+        _pools[key] = ConnectionPool(
+            replica.connection_string,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            kwargs={'autocommit': True},
+            open=True
+        )
+
+    return _pools[key]
+
+def warm_pools(replicas: list[Replica]):
+    '''
+    Opens the connection pools for every replica in the current process
+    and waits until each holds its minimum number of connections, so that
+    the connections are ready before anything is timed.
+
+    :param replicas: the replicas to connect to
+    '''
+    for replica in replicas:
+        get_pool(replica).wait()
+
 class Connection:
-    def __init__(self, replica: Replica):
+    def __init__(self, replica: Replica, pooled: bool = False):
         '''
         Represents a single connection to each database.
 
@@ -14,14 +62,29 @@ class Connection:
         but they're not all going to the same database, so that isn't too
         much).
 
+        A pooled connection is borrowed from a per-process pool for the
+        replica (see `get_pool`) and is returned to it when this object is
+        closed, so repeatedly connecting to the same replica from within one
+        process doesn't pay for a new connection every time. Only worker
+        processes (the refresh workers and the table loaders) use pooled
+        connections: the main process forks the streams and workers, and must
+        not have a pool's threads running when it does.
+
         Connections should only be created from *within* each spawned process
         (typically from the `QueryStream` class), presuming they're being used
         in a multiprocess context.
 
         :param replica: the database `Replica` we are connecting to
+        :param pooled: borrow the connection from this process's pool for the replica?
         '''
         self.replica = replica
-        self._connection = psycopg.connect(replica.connection_string, autocommit=True)
+        self._pool = None
+
+        if pooled:
+            self._pool = get_pool(replica)
+            self._connection = self._pool.getconn()
+        else:
+            self._connection = psycopg.connect(replica.connection_string, autocommit=True)
     
     def conn(self):
         if self._connection is not None:
@@ -32,5 +95,8 @@ class Connection:
     
     def close(self):
         if self._connection is not None:
-            self._connection.close()
+            if self._pool is not None:
+                self._pool.putconn(self._connection)
+            else:
+                self._connection.close()
             self._connection = None
@@ -3,12 +3,27 @@ import os
 import subprocess
 import shutil
 import logging
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 from replica import Replica
 from connection import Connection
 
+from tpc_const import ORDERS_TYPES, LINEITEM_TYPES, TABLE_COLUMNS
+
 TABLE_BLOCK_SIZE = 5_120_000
 
+# how to convert a value in the refresh data to a Python value of each column type
+COLUMN_PARSERS = {
+    'int4': int,
+    'numeric': Decimal,
+    'date': date.fromisoformat,
+    'bpchar': str,
+    'varchar': str
+}
+
 class Generator:
     def __init__(self, replicas: list[Replica], dbgen_path: str, data_path: str, scale_factor: int, n_query_streams: int):
         '''
@@ -37,6 +52,7 @@ class Generator:
         self.n_query_streams = n_query_streams
         self.dbname = replicas[0].dbname
         self.root_dir = os.path.dirname(os.path.realpath(__file__))
+        self.n_chunks = os.cpu_count() or 1
     
     def generate(self):
         '''
@@ -50,9 +66,7 @@ class Generator:
         self._create_directories()
         self._move_query_templates()
         self._compile_dbgen()
-        self._create_table_data()
-        self._format_table_data()
-        self._create_refresh_data()
+        self._create_data()
         self._create_queries()
 
     def load_database(self):
@@ -66,19 +80,20 @@ class Generator:
         connections = [Connection(replica) for replica in self.replicas]
         tables = []
 
-        for table_file in glob.glob(f'{self.data_path}/tables/*.tbl'):
-            name = os.path.basename(table_file)
-            tables.append(name.split('.')[0])
+        for table_file in sorted(glob.glob(f'{self.data_path}/tables/*.tbl*')):
+            name = os.path.basename(table_file).split('.')[0]
+            if name not in tables:
+                tables.append(name)
 
         self._reset_database(connections, tables)
         self._create_schemas(connections)
-        self._load_table_data(connections)
+        self._load_table_data()
         self._create_keys(connections)
 
         for c in connections:
             c.close()
 
-    def read_data(self) -> tuple[list[str], list[list[dict[str, list[str]]]], list[list[str]]]:
+    def read_data(self) -> tuple[list[str], list[list[dict[str, tuple | list[tuple]]]], list[list[str]]]:
         '''
         Loads the query and refresh data into memory.
 
@@ -90,7 +105,7 @@ class Generator:
         but we need to serialise it to pass them to the spawned subprocesses.
 
         :returns queries: the 22 generated queries to be executed according to the stream order given in the specification
-        :returns rf1_data: the data for the first refresh function: a dict with a new ORDER and a list of new LINEITEMs
+        :returns rf1_data: the data for the first refresh function: a dict with a new ORDER and a list of new LINEITEMs (each row a tuple of typed values)
         :returns rf2_data: the data for the second refresh function: a list of orderkeys to delete from ORDERS and LINEITEM
         '''
         return self._load_queries(), self._load_rf1_data(), self._load_rf2_data()
@@ -104,30 +119,81 @@ class Generator:
 
     def _compile_dbgen(self):
         logging.debug(f'attempting to compile TPC-H dbgen at {self.dbgen_path}')
-        subprocess.run('make', cwd=self.dbgen_path)
+        subprocess.run(['make', f'-j{os.cpu_count() or 1}'], cwd=self.dbgen_path)
     
-    def _create_table_data(self):
-        logging.debug(f'creating table data for scale factor {self.scale_factor}')
-        subprocess.run([f'{self.dbgen_path}/dbgen', '-s', self.scale_factor, '-vf'], cwd=self.dbgen_path)
+    def _create_data(self):
+        '''
+        Runs dbgen to create the table data and the refresh function data.
+
+        When given `-U`, dbgen only builds the update sets, so the refresh data
+        can't come out of the same dbgen run as the tables. Instead of running
+        one after the other, the refresh data run is started alongside the
+        table data chunks and they all run at the same time.
+        '''
+        processes = self._start_table_data()
+        processes.append(self._start_refresh_data())
+
+        for process in processes:
+            process.wait()
+
+        self._move_table_data()
+
+    def _start_table_data(self) -> list[subprocess.Popen]:
+        '''
+        Starts generating the table data. dbgen is single-threaded, so the data is
+        split into one chunk per CPU (`-C`) and each chunk is built by its own dbgen
+        process (`-S`), writing into its own directory (`DSS_PATH`).
+
+        :returns: the running dbgen processes
+        '''
+        table_dir = f'{self.data_path}/tables'
+        logging.debug(f'creating table data for scale factor {self.scale_factor} in {self.n_chunks} chunks')
+
+        # clear out the data from any previous run, which may have used a different number of chunks
+        for table_file in glob.glob('*.tbl*', root_dir=table_dir):
+            os.remove(f'{table_dir}/{table_file}')
+
+        processes = []
+
+        for step in range(1, self.n_chunks + 1):
+            chunk_dir = f'{table_dir}/chunks/{step}'
+            os.makedirs(chunk_dir, exist_ok=True)
+            processes.append(subprocess.Popen([f'{self.dbgen_path}/dbgen', '-s', self.scale_factor, '-C', str(self.n_chunks), '-S', str(step), '-vf'],
+                                              cwd=self.dbgen_path,
+                                              env=dict(os.environ, DSS_PATH=chunk_dir)))
 
-        table_paths = glob.glob('*.tbl', root_dir=self.dbgen_path)
+        return processes
 
-        for file in table_paths:
-            shutil.move(f'{self.dbgen_path}/{file}', f'{self.data_path}/tables/{os.path.basename(file)}')
+    def _move_table_data(self):
+        '''
+        The chunks aren't joined back together: each is moved into the table
+        directory as-is (eg `lineitem.tbl.3`) and loaded with its own `COPY`, which
+        saves writing and reading all of the table data a second time.
+        '''
+        table_dir = f'{self.data_path}/tables'
+        chunk_root = f'{table_dir}/chunks'
+
+        # the small tables (nation and region) aren't split into chunks, and every
+        # step generates the whole table, so those are taken from the first chunk
+        for step in range(1, self.n_chunks + 1):
+            for table_file in glob.glob('*.tbl.*' if step > 1 else '*.tbl*', root_dir=f'{chunk_root}/{step}'):
+                shutil.move(f'{chunk_root}/{step}/{table_file}', f'{table_dir}/{table_file}')
+
+        shutil.rmtree(chunk_root)
 
-        shutil.copy(f'{self.dbgen_path}/dss.ddl', f'{self.data_path}/schema/dss.ddl')
         shutil.copy(f'{self.root_dir}/schema_keys.sql', f'{self.data_path}/schema/schema_keys.sql')
     
-    def _create_refresh_data(self):
-        logging.debug(f'creating refresh function data for scale factor {self.scale_factor}')
-        subprocess.run([f'{self.dbgen_path}/dbgen', '-s', self.scale_factor, '-vf', '-U', str(self.n_query_streams)], cwd=self.dbgen_path)
-
-        update_paths = glob.glob('*.tbl.u*', root_dir=self.dbgen_path)
-        delete_paths = glob.glob('delete.*', root_dir=self.dbgen_path)
-        update_paths.extend(delete_paths)
+    def _start_refresh_data(self) -> subprocess.Popen:
+        '''
+        Starts generating the refresh function data, written straight into the
+        refresh data directory.
 
-        for file in update_paths:
-            shutil.move(f'{self.dbgen_path}/{file}', f'{self.data_path}/refresh/{os.path.basename(file)}')
+        :returns: the running dbgen process
+        '''
+        logging.debug(f'creating refresh function data for scale factor {self.scale_factor}')
+        return subprocess.Popen([f'{self.dbgen_path}/dbgen', '-s', self.scale_factor, '-vf', '-U', str(self.n_query_streams)],
+                                cwd=self.dbgen_path,
+                                env=dict(os.environ, DSS_PATH=f'{self.data_path}/refresh'))
     
     def _move_query_templates(self):
         existing_templates = glob.glob(f'{self.dbgen_path}/queries/*.sql')
@@ -149,6 +215,22 @@ class Generator:
                                env=dict(os.environ, DSS_QUERY=f'{self.dbgen_path}/queries'),
                                stdout=outfile)
     
+    def _execute_on_replicas(self, connections: list[Connection], sql: str):
+        '''
+        Executes the same SQL on every replica. Each replica has its own
+        connection, so this is done on a thread per replica, and the replicas
+        are all working at the same time.
+
+        :param connections: a connection to each replica
+        :param sql: the statement(s) to execute
+        '''
+        def execute(c: Connection):
+            with c.conn().cursor() as cur:
+                cur.execute(sql)
+
+        with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+            list(executor.map(execute, connections))
+
     def _reset_database(self, connections: list[Connection], tables: list[str]):
         '''
         Drops the tables specified.
@@ -156,88 +238,124 @@ class Generator:
         :param tables: a list of table names
         '''
         logging.debug(f'dropping existing tables: {tables}')
-        for c in connections:
-            with c.conn().cursor() as cur:
-                for table in tables:
-                    cur.execute(f'DROP TABLE IF EXISTS {table} CASCADE')
+        if tables:
+            table_list = ', '.join(tables)
+            self._execute_on_replicas(connections, f'DROP TABLE IF EXISTS {table_list} CASCADE')
 
     def _create_schemas(self, connections: list[Connection]):
         logging.info('creating the schemas for tables')
-        for c in connections:
-            with c.conn().cursor() as cur:
-                with open(f'{self.data_path}/schema/dss.ddl', 'r') as infile:
-                    cur.execute(infile.read())
+        # read from the repository rather than the data directory, so that data
+        # generated before the table layout changed can still be loaded
+        with open(f'{self.root_dir}/schema_tables.sql', 'r') as infile:
+            self._execute_on_replicas(connections, infile.read())
 
     def _create_keys(self, connections: list[Connection]):
         logging.info('creating primary and foreign keys')
-        for c in connections:
-            with c.conn().cursor() as cur:
-                with open(f'{self.data_path}/schema/schema_keys.sql', 'r') as infile:
-                    cur.execute(infile.read())
+        with open(f'{self.data_path}/schema/schema_keys.sql', 'r') as infile:
+            self._execute_on_replicas(connections, infile.read())
     
-    def _format_table_data(self):
+    def _read_table_blocks(self, table_file: str):
         '''
         The table data by default includes a trailing pipe (|) character
         that must be removed for Postgres to process it correctly with the
-        `COPY FROM ... FORMAT CSV` command. We do that in-place here.
+        `COPY FROM ... FORMAT CSV` command. Rather than rewriting each file
+        on disk, we strip it from each block as it is streamed to the database.
+
+        Each block is extended to the end of the line it stops in, so a
+        row's trailing pipe is never split across two blocks.
+
+        :param table_file: the path to the table data
+        :returns: an iterator over the corrected blocks of table data
         '''
-        logging.info('correcting table data CSV format for postgres...')
-        for table_file in glob.glob(f'*.tbl', root_dir=f'{self.data_path}/tables'):
-            logging.debug(table_file)
-            subprocess.run(['sed', '-i', 's/.$//', table_file], cwd=f'{self.data_path}/tables')
+        with open(table_file, 'rb') as infile:
+            while block := infile.read(TABLE_BLOCK_SIZE):
+                block += infile.readline()
+                yield block.replace(b'|\n', b'\n')
     
-    def _load_table_data(self, connections: list[Connection]):
-        for table_file in glob.glob(f'{self.data_path}/tables/*.tbl'):
-            table = os.path.basename(table_file).split('.')[0]
-            logging.info(f'loading data into {table}')
-            for num, c in enumerate(connections):
-                logging.debug(f'loading to replica {num}')
-                with c.conn().cursor() as cur:
-                    with cur.copy(f'COPY {table} FROM STDIN (format csv, delimiter \'|\')') as copy:
-                        with open(table_file, 'r') as input:
-                            while data := input.read(TABLE_BLOCK_SIZE):
-                                copy.write(data)
+    def _load_table_data(self):
+        '''
+        Loads the table data into every replica. Each (table file, replica)
+        pair is loaded by its own COPY (a table may be split across several
+        files, one for each chunk dbgen generated it in), and these are run in
+        parallel across a pool of worker processes so that the replicas aren't
+        left idle while another table or replica is being loaded.
+        '''
+        jobs = []
+
+        with ProcessPoolExecutor(max_workers=len(self.replicas) * 2) as executor:
+            # largest files first, so the long-running COPYs aren't left until the end
+            table_files = sorted(glob.glob(f'{self.data_path}/tables/*.tbl*'), key=os.path.getsize, reverse=True)
+
+            for table_file in table_files:
+                for replica in self.replicas:
+                    jobs.append(executor.submit(self._copy_table_data, table_file, replica))
+
+            for job in as_completed(jobs):
+                job.result()
+
+    def _copy_table_data(self, table_file: str, replica: Replica):
+        '''
+        Loads the data for a single table into a single replica. This is run
+        in a worker process, so it borrows a connection from that worker's own
+        pool for the replica, which is reused by the worker's later loads.
+
+        :param table_file: the path to the table data
+        :param replica: the replica to load the data into
+        '''
+        table = os.path.basename(table_file).split('.')[0]
+        columns = ', '.join(TABLE_COLUMNS[table])
+        logging.info(f'loading data into {table} on replica {replica.id}')
+        connection = Connection(replica, pooled=True)
+
+        with connection.conn().cursor() as cur:
+            with cur.copy(f'COPY {table} ({columns}) FROM STDIN (format csv, delimiter \'|\')') as copy:
+                for block in self._read_table_blocks(table_file):
+                    copy.write(block)
+
+        connection.close()
 
     def _load_queries(self) -> list[str]:
         logging.info('reading queries')
-        queries = []
+        # read by number rather than globbing, so they are always in canonical order (1-22)
+        return [Path(f'{self.data_path}/queries/{i}.sql').read_text() for i in range(1, 23)]
 
-        for i in range(1, 23):
-            with open(f'{self.data_path}/queries/{i}.sql', 'r') as infile:
-                queries.append(infile.read())
-        
-        return queries
+    def _parse_row(self, line: str, types: list[str]) -> tuple:
+        '''
+        Parses a row of refresh data into the Python values for each of its
+        columns, so that it can be written with `COPY ... (FORMAT BINARY)`
+        without any conversion during the refresh function.
+
+        :param line: the row, as generated by dbgen
+        :param types: the Postgres type of each column
+        :returns: the typed values of the row
+        '''
+        values = line[:-2].split('|') # omits trailing | and newline character
+        return tuple(COLUMN_PARSERS[type](value) for type, value in zip(types, values))
 
-    def _load_rf1_data(self) -> list[dict[str, list[str]]]:
+    def _load_rf1_data(self) -> list[list[dict[str, tuple | list[tuple]]]]:
         logging.info('loading data for refresh function #1')
 
         rf1_data = []
 
         for i in range(self.n_query_streams):
-            lineitems = open(f'{self.data_path}/refresh/lineitem.tbl.u{i + 1}')
-            orders = open(f'{self.data_path}/refresh/orders.tbl.u{i + 1}')
-
-            stream_order = []
             stream_data = {}
 
-            for order in orders:
-                this_entry = {
-                    'order': order[:-2], # omits trailing | and newline character
-                    'lineitems': []
-                }
-
-                orderkey = order.split('|')[0]
-                stream_order.append(orderkey)
-                stream_data[orderkey] = this_entry
-            
-            for lineitem in lineitems:
-                orderkey = lineitem.split('|')[0]
-                stream_data[orderkey]['lineitems'].append(lineitem[:-2])
-            
-            lineitems.close()
-            orders.close()
-
-            rf1_data.append([stream_data[orderkey] for orderkey in stream_order])
+            # dicts preserve insertion order, so the orders stay in the order
+            # they were generated in
+            with open(f'{self.data_path}/refresh/orders.tbl.u{i + 1}', 'r') as orders:
+                for order in orders:
+                    orderkey = order.partition('|')[0]
+                    stream_data[orderkey] = {
+                        'order': self._parse_row(order, ORDERS_TYPES),
+                        'lineitems': []
+                    }
+
+            with open(f'{self.data_path}/refresh/lineitem.tbl.u{i + 1}', 'r') as lineitems:
+                for lineitem in lineitems:
+                    orderkey = lineitem.partition('|')[0]
+                    stream_data[orderkey]['lineitems'].append(self._parse_row(lineitem, LINEITEM_TYPES))
+
+            rf1_data.append(list(stream_data.values()))
         
         return rf1_data
 
@@ -247,7 +365,15 @@ class Generator:
         rf2_data = []
 
         for i in range(self.n_query_streams):
-            with open(f'{self.data_path}/refresh/delete.{i + 1}', 'r') as infile:
-                rf2_data.append([orderkey[:-2] for orderkey in infile.readlines()]) # trim trailing pipe character
+            lines = Path(f'{self.data_path}/refresh/delete.{i + 1}').read_text().splitlines()
+            orderkeys = [line.rstrip('|') for line in lines] # trim trailing pipe character
+
+            # the keys are converted with `int` by the refresh pairs, so check
+            # here that each one is a plain number rather than failing mid-run
+            invalid = [orderkey for orderkey in orderkeys if not orderkey.isdigit()]
+            if invalid:
+                raise ValueError(f'delete.{i + 1}: invalid orderkeys {invalid[:5]}')
+
+            rf2_data.append(orderkeys)
         
         return rf2_data
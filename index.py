@@ -0,0 +1,15 @@
+from typing import NamedTuple
+
+class Index(NamedTuple):
+    '''
+    A single index from the index configuration.
+
+    The column list is kept already joined, ready to be substituted
+    into `CREATE INDEX`, so it doesn't need rebuilding for every
+    statement.
+
+    :param table: the table the index is built on
+    :param columns: the indexed columns, comma-separated (eg `l_shipdate,l_discount`)
+    '''
+    table: str
+    columns: str
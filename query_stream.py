@@ -1,10 +1,43 @@
 import logging
 import time
-from multiprocessing import Process, Queue
-from connection import Connection
+import multiprocessing
+from multiprocessing import Queue
+from concurrent.futures import ProcessPoolExecutor
+from connection import Connection, warm_pools
 from replica import Replica
 from refresh_pair import RefreshPair
 
+# the refresh pairs a refresh worker process runs, all for the same replica.
+# they are handed over once as the worker starts (see `_start_refresh_worker`),
+# so each refresh function only has to send the worker its index
+_worker_refresh_pairs: list[RefreshPair] = []
+
+def _start_refresh_worker(replica: Replica, refresh_pairs: list[RefreshPair]):
+    '''
+    Runs as each refresh worker process starts: keeps the refresh pairs it
+    will run, and opens its connections to the replica they run on.
+
+    :param replica: the replica this worker runs the refresh functions on
+    :param refresh_pairs: the refresh pairs for that replica, in stream order
+    '''
+    global _worker_refresh_pairs
+    _worker_refresh_pairs = refresh_pairs
+    warm_pools([replica])
+
+def _run_refresh_function(i: int, function: int) -> dict[str, int]:
+    '''
+    Runs one of the refresh functions of this worker's `i`th refresh pair.
+
+    :param i: which refresh pair to run
+    :param function: which refresh function to run (1 or 2)
+    :returns: the start and end times of the refresh function
+    '''
+    refresh_pair = _worker_refresh_pairs[i]
+
+    if function == 1:
+        return refresh_pair.run_refresh_function_1()
+    return refresh_pair.run_refresh_function_2()
+
 class QueryStream:
     def __init__(self, num: int, replicas: list[Replica], queries: list[str], routes: list[int], order: list[int], rf1_data, rf2_data, num_refresh_pairs: int, timer_queue: Queue):
         '''
@@ -22,8 +55,9 @@ class QueryStream:
         '''
         self.num = num
         self.replicas = replicas
-        self.connections = [Connection(replica) for replica in replicas]
-        self.cursors = [c.conn().cursor() for c in self.connections]
+        self.connections = []
+        self.cursors = []
+        self.schedule = []
         self.num_refresh_pairs = num_refresh_pairs
         self.refresh_pairs = [[RefreshPair(rf1_data[i], rf2_data[i], replica) for replica in replicas] for i in range(num_refresh_pairs)]
 
@@ -31,10 +65,11 @@ class QueryStream:
         self.routes = routes
         self.order = order
 
-        # we need to pass timing intervals, both back to the main process
-        # and from our own refresh stream subprocesses we spawn
+        # we need to pass timing intervals back to the main process
         self.timer_queue = timer_queue
-        self.refresh_time_queue = Queue()
+        # the refresh functions are run by a worker process for each replica
+        # that lives as long as the stream is running (see `_start_refresh_workers`)
+        self.refresh_workers = []
         self.start_time = None
         self.query_times = [None for _ in range(22)]
         self.refresh_times = [None, None]
@@ -46,6 +81,8 @@ class QueryStream:
         Run this query stream in POWER TEST mode.
         '''
         self.mode = 'power'
+        self._connect()
+        self._start_refresh_workers()
         self._run_refresh_function_1(0)
         self._run_query_set()
         self._run_refresh_function_2(0)
@@ -60,9 +97,12 @@ class QueryStream:
         Run this query stream in THROUGHPUT TEST mode (don't execute the refresh functions -- they'll be run by a separate stream).
         '''
         self.mode = 'throughput'
-        self.start_time = time.time()
+        self._connect()
+        # the stream times share a clock with the refresh stream's, which are
+        # taken with `time.perf_counter_ns` in the refresh workers
+        self.start_time = time.perf_counter()
         self._run_query_set()
-        self.end_time = time.time()
+        self.end_time = time.perf_counter()
         
         self._finalise()
     
@@ -71,31 +111,75 @@ class QueryStream:
         Run REFRESH STREAMS only.
         '''
         self.mode = 'refresh'
+        self._start_refresh_workers()
         for i in range(self.num_refresh_pairs):
             self._run_refresh_function_1(i)
             self._run_refresh_function_2(i)
 
         self._finalise()
 
+    def _connect(self):
+        '''
+        Opens the connections used to run the query set. This happens when
+        the stream is run, rather than when it is created, so that the
+        connections belong to the process actually executing the stream.
+        '''
+        self.connections = [Connection(replica) for replica in self.replicas]
+        self.cursors = [c.conn().cursor() for c in self.connections]
+
+        # (query number, cursor for its replica, query text) in execution order,
+        # so that the timed loop doesn't have to look any of them up
+        self.schedule = []
+        for query in self.order:
+            execute = query - 1
+            self.schedule.append((execute, self.cursors[self.routes[execute]], self.queries[execute]))
+
+    def _start_refresh_workers(self):
+        '''
+        Starts the worker processes that run the refresh functions, one for
+        each replica, so that the replicas' refresh functions always run side by
+        side. These are reused for every refresh pair in this stream, so we
+        only pay for starting them (and for their connections) once.
+
+        Each worker is given the refresh pairs for its replica as it starts, and
+        opens its connections to the replica then, rather than on its first
+        refresh function. The refresh data is therefore only passed to a worker
+        once, not with every refresh function it runs.
+
+        The workers are started from a fork server rather than forked from this
+        process: once the first executor is running its manager thread, forking
+        the next executor's worker from here would fork with live threads.
+        '''
+        self.refresh_workers = []
+        context = multiprocessing.get_context('forkserver')
+
+        for r, replica in enumerate(self.replicas):
+            refresh_pairs = [pairs[r] for pairs in self.refresh_pairs]
+            self.refresh_workers.append(ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_start_refresh_worker, initargs=(replica, refresh_pairs)))
+
     def _run_query_set(self):
-        for i in range(22):
-            execute = self.order[i] - 1
-            replica = self.routes[execute]
-            tic = time.time()
-            self.cursors[replica].execute(self.queries[execute])
-            toc = time.time()
-            logging.debug(f'QS{self.num}:Q{execute + 1} : {round(toc - tic, 2)}s')
-            self.query_times[execute] = toc - tic
+        # queries are deliberately not sent in pipeline mode: each query must be
+        # timed on its own (TPC-H clause 5.3.7), and Q15 is several statements
+        # in one string, which libpq can only send with the simple query protocol.
+        # for the same reason they aren't prepared -- and since prepared statements
+        # only live as long as the session, and each stream runs every query once
+        # on its own connection, there would be no later execution to benefit anyway
+        perf_counter_ns = time.perf_counter_ns
+
+        for execute, cursor, query in self.schedule:
+            tic = perf_counter_ns()
+            cursor.execute(query)
+            toc = perf_counter_ns()
+            self.query_times[execute] = (toc - tic) * 1e-9
+            logging.debug(f'QS{self.num}:Q{execute + 1} : {round(self.query_times[execute], 2)}s')
 
     
     def _run_refresh_function_1(self, i):
         logging.debug(f'starting refresh function #1 in query stream {self.num}:I{i}')
-        processes = [Process(target=r.run_refresh_function_1, args=(self.refresh_time_queue,)) for r in self.refresh_pairs[i]]
-        [p.start() for p in processes]
-        [p.join() for p in processes]
-        times = [self.refresh_time_queue.get() for _ in processes]
-        start_time = min([time['start'] for time in times])
-        end_time = max([time['end'] for time in times])
+        futures = [worker.submit(_run_refresh_function, i, 1) for worker in self.refresh_workers]
+        times = [f.result() for f in futures]
+        start_time = min([time['start'] for time in times]) * 1e-9
+        end_time = max([time['end'] for time in times]) * 1e-9
         logging.debug(f'QS{self.num}:I{i}:RF1 : {round(end_time - start_time, 2)}s')
         if self.start_time is None:
             self.start_time = start_time
@@ -103,17 +187,17 @@ class QueryStream:
 
     def _run_refresh_function_2(self, i):
         logging.debug(f'starting refresh function #2 in query stream {self.num}:I{i}')
-        processes = [Process(target=r.run_refresh_function_2, args=(self.refresh_time_queue,)) for r in self.refresh_pairs[i]]
-        [p.start() for p in processes]
-        [p.join() for p in processes]
-        times = [self.refresh_time_queue.get() for _ in processes]
-        start_time = min([time['start'] for time in times])
-        end_time = max([time['end'] for time in times])
+        futures = [worker.submit(_run_refresh_function, i, 2) for worker in self.refresh_workers]
+        times = [f.result() for f in futures]
+        start_time = min([time['start'] for time in times]) * 1e-9
+        end_time = max([time['end'] for time in times]) * 1e-9
         logging.debug(f'QS{self.num}:I{i}:RF2 : {round(end_time - start_time, 2)}s')
         self.end_time = end_time
         self.refresh_times[1] = end_time - start_time
     
     def _finalise(self):
+        for worker in self.refresh_workers:
+            worker.shutdown()
         for cursor in self.cursors:
             cursor.close()
         for connection in self.connections:
@@ -1,65 +1,118 @@
 import time
-import logging
+from concurrent.futures import ThreadPoolExecutor
+from psycopg import Cursor
 from connection import Connection
 from replica import Replica
 
+from tpc_const import ORDERS_TYPES, LINEITEM_TYPES, TABLE_COLUMNS
+
+# the rows are in dbgen's column order, which the tables aren't laid out in,
+# so the COPYs name their columns
+ORDERS_COPY = 'COPY orders ({}) FROM STDIN (FORMAT BINARY)'.format(', '.join(TABLE_COLUMNS['orders']))
+LINEITEM_COPY = 'COPY lineitem ({}) FROM STDIN (FORMAT BINARY)'.format(', '.join(TABLE_COLUMNS['lineitem']))
+
+# the lineitem delete is a data-modifying CTE so that both tables are
+# cleared by the same statement
+RF2_DELETE = '''
+    WITH deleted_lineitems AS (
+        DELETE FROM LINEITEM WHERE L_ORDERKEY = ANY(%(orderkeys)s)
+    )
+    DELETE FROM ORDERS WHERE O_ORDERKEY = ANY(%(orderkeys)s)
+'''
+
 class RefreshPair:
-    def __init__(self, rf1_data: list[dict[str, list[str]]], rf2_data: list[str], replica: Replica):
+    def __init__(self, rf1_data: list[dict[str, tuple | list[tuple]]], rf2_data: list[str], replica: Replica):
         '''
         A class that represents a pair of refresh functions
         for a given QueryStream. 
         '''
-        self.rf1_data = rf1_data
-        self.rf2_data = self.generate_queries_for_rf2(rf2_data)
+        self.order_rows, self.lineitem_rows = self.generate_data_for_rf1(rf1_data)
+        self.rf2_data = self.generate_data_for_rf2(rf2_data)
         self.replica = replica
 
-    def generate_queries_for_rf2(self, rf2_data: list[str]):
+    def generate_data_for_rf1(self, rf1_data: list[dict[str, tuple | list[tuple]]]) -> tuple[list[tuple], list[tuple]]:
+        '''
+        `rf1_data` is a list of new orders, each with the new lineitems that
+        belong to it. The two tables are written by separate `COPY`s, so here
+        we flatten it into one list of rows for each table, so that the timed
+        loop only has to write them out (note this is permitted by TPC-H
+        clause 2.5.3.1).
+
+        :param rf1_data: the new orders and their lineitems
+        :returns order_rows: the rows to insert into ORDERS
+        :returns lineitem_rows: the rows to insert into LINEITEM
+        '''
+        order_rows = [order['order'] for order in rf1_data]
+        lineitem_rows = [lineitem for order in rf1_data for lineitem in order['lineitems']]
+
+        return order_rows, lineitem_rows
+
+    def generate_data_for_rf2(self, rf2_data: list[str]) -> list[int]:
         '''
         `rf2_data` is a list of `orderkey`s that must be deleted from both the
-        orders and the lineitem table. Here, we precompute the query strings so
-        that we don't have to use template substitution while actually in the timed
-        loop (note this is permitted by TPC-H clause 2.5.3.1).
+        orders and the lineitem table. Rather than issuing a `DELETE` for every
+        key, all of the keys are sent as a single array parameter and deleted
+        with `= ANY(...)` (the same as an `IN` list). Here, we precompute the
+        keys as integers so that we don't have to convert them while actually
+        in the timed loop (note this is permitted by TPC-H clause 2.5.3.1).
 
         :param rf2_data: the list of keys to delete
-        :returns rf2_data: a list of queries to execute, with the keys substituted in
+        :returns rf2_data: the keys to delete, as integers
         '''
-        queries = []
-
-        for orderkey in rf2_data:
-            queries.append('DELETE FROM LINEITEM WHERE L_ORDERKEY = %s' % orderkey)
-            queries.append('DELETE FROM ORDERS WHERE O_ORDERKEY = %s' % orderkey)
-        
-        return queries
+        return [int(orderkey) for orderkey in rf2_data]
     
-    def run_refresh_function_1(self, timer_queue):
-        order_connection = Connection(self.replica)
+    def _copy_rows(self, cursor: Cursor, statement: str, types: list[str], rows: list[tuple]):
+        '''
+        Writes rows to a table with a single binary `COPY`.
+
+        :param cursor: the cursor to run the `COPY` on
+        :param statement: the `COPY ... FROM STDIN (FORMAT BINARY)` statement
+        :param types: the Postgres type of each column
+        :param rows: the rows to write
+        '''
+        with cursor.copy(statement) as copy:
+            copy.set_types(types)
+            for row in rows:
+                copy.write_row(row)
+
+    def run_refresh_function_1(self) -> dict[str, int]:
+        order_connection = Connection(self.replica, pooled=True)
         order_cursor = order_connection.conn().cursor()
-        lineitem_connection = Connection(self.replica)
+        lineitem_connection = Connection(self.replica, pooled=True)
         lineitem_cursor = lineitem_connection.conn().cursor()
         start_time = None
+        # the orders transaction is nested inside the lineitem one, so that the
+        # new orders are committed before the deferred FK checks on lineitem run
         with lineitem_connection.conn().transaction():
             # defer FK checking
-            lineitem_cursor.execute('SET CONSTRAINTS lineitem_l_orderkey_fkey DEFERRED')
-            start_time = time.time()
-            with order_cursor.copy('COPY orders FROM STDIN') as order_copy, lineitem_cursor.copy('COPY lineitem FROM STDIN') as lineitem_copy:
-                for orderkey in self.rf1_data:
-                    order_copy.write_row(orderkey['order'].split('|'))
-                    for lineitem in orderkey['lineitems']:
-                        lineitem_copy.write_row(lineitem.split('|'))
-        end_time = time.time()
-        timer_queue.put({'start': start_time, 'end': end_time})
+            lineitem_cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+            with order_connection.conn().transaction():
+                # the two COPYs are driven from their own threads, so that one
+                # table's rows are being sent while the other's are formatted
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    start_time = time.perf_counter_ns()
+                    copies = [
+                        executor.submit(self._copy_rows, order_cursor, ORDERS_COPY, ORDERS_TYPES, self.order_rows),
+                        executor.submit(self._copy_rows, lineitem_cursor, LINEITEM_COPY, LINEITEM_TYPES, self.lineitem_rows)
+                    ]
+                    for copy in copies:
+                        copy.result()
+        end_time = time.perf_counter_ns()
         order_cursor.close()
         lineitem_cursor.close()
         order_connection.close()
         lineitem_connection.close()
+        return {'start': start_time, 'end': end_time}
     
-    def run_refresh_function_2(self, timer_queue):
-        connection = Connection(self.replica)
+    def run_refresh_function_2(self) -> dict[str, int]:
+        connection = Connection(self.replica, pooled=True)
+        conn = connection.conn()
         start_time = None
-        with connection.conn().cursor() as cur:
-            start_time = time.time()
-            for query in self.rf2_data:
-                cur.execute(query)
-        end_time = time.time()
-        timer_queue.put({'start': start_time, 'end': end_time})
+        with conn.cursor() as cur:
+            start_time = time.perf_counter_ns()
+            # both deletes are a single statement, so they run atomically in
+            # one round trip without an explicit transaction
+            cur.execute(RF2_DELETE, {'orderkeys': self.rf2_data})
+        end_time = time.perf_counter_ns()
         connection.close()
+        return {'start': start_time, 'end': end_time}
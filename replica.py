@@ -11,4 +11,13 @@ class Replica:
         self.connection_string = self._connection_string()
 
     def _connection_string(self) -> str:
-        return f'host={self.hostname} port={self.port} dbname={self.dbname} user={self.user} password={self.password}'
+        # a connection can sit idle for a long time mid-test: a refresh worker's
+        # connections wait out the whole power test query set between RF1 and
+        # RF2, and a stream's connection to one replica waits while its queries
+        # run on the others. libpq sends keepalives by default, but only after
+        # the kernel's 2 hour idle time, so start them sooner in case anything
+        # between us and the replica drops idle connections
+        return (
+            'keepalives_idle=30 '
+            f'host={self.hostname} port={self.port} dbname={self.dbname} user={self.user} password={self.password}'
+        )
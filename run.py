@@ -1,11 +1,29 @@
 import argparse
+import csv
+import functools
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
 
 from benchmark import Benchmark
 from replica import Replica
+from index import Index
 from generator import Generator
 
+# the prefix of each TPC-H column name, and the table it belongs to
+PREFIXES = {
+    'l': 'LINEITEM',
+    'p': 'PART',
+    'ps': 'PARTSUPP',
+    'o': 'ORDERS',
+    'c': 'CUSTOMER',
+    'n': 'NATION',
+    'r': 'REGION',
+    's': 'SUPPLIER'
+}
+
 def create_arguments():
     parser = argparse.ArgumentParser()
 
@@ -44,6 +62,7 @@ def get_default_query_streams(scale_factor: int) -> int:
     else:
         return 11
 
+@functools.lru_cache(maxsize=None)
 def table_from_column_prefix(column: str) -> str:
     '''
     Given the name of a column in the TPC-H benchmark,
@@ -53,26 +72,16 @@ def table_from_column_prefix(column: str) -> str:
     :param column: the column name (eg ps_suppkey)
     :returns: the table name (eg PARTSUPP)
     '''
-    PREFIXES = {
-        'l': 'LINEITEM',
-        'p': 'PART',
-        'ps': 'PARTSUPP',
-        'o': 'ORDERS',
-        'c': 'CUSTOMER',
-        'n': 'NATION',
-        'r': 'REGION',
-        's': 'SUPPLIER'
-    }
-    prefix = column.split('_')[0]
+    prefix = column[:column.index('_')]
 
     return PREFIXES[prefix]
 
 def get_replicas(path: str):
     replicas = []
-    with open(path, 'r') as infile:
-        lines = infile.readlines()
-        for config in lines:
-            fields = config.split(',')
+    with open(path, 'r', newline='') as infile:
+        for fields in csv.reader(infile):
+            if not fields:
+                continue
             replicas.append(
                 Replica(
                     id=fields[0],
@@ -85,28 +94,44 @@ def get_replicas(path: str):
             )
     return replicas
 
-def get_index_config(path: str, num_replicas: int) -> list[tuple[str]]:
-    indexes = []
-    for replica in range(num_replicas):
-        indexes.append([])
+def check_replicas(replicas: list[Replica]):
+    '''
+    Connects to every replica at once and disconnects again, so that an
+    unreachable replica is reported before any of the benchmark phases start.
+
+    These are plain connections rather than pooled ones: the main process
+    never opens a pool, since it forks the workers and streams, and pools are
+    only used by the worker processes that load the tables and run the refresh
+    functions (see `connection.Connection`).
+
+    :param replicas: the replicas to connect to
+    '''
+    def check(replica: Replica):
+        logging.debug(f'checking connection to replica {replica.id}')
+        psycopg.connect(replica.connection_string).close()
+
+    with ThreadPoolExecutor(max_workers=len(replicas)) as executor:
+        list(executor.map(check, replicas))
+
+def get_index_config(path: str, num_replicas: int) -> list[list[Index]]:
+    indexes = [[] for _ in range(num_replicas)]
     
-    with open(path, 'r') as infile:
-        lines = infile.readlines()
-        for index in lines:
-            fields = index.split(',')
+    with open(path, 'r', newline='') as infile:
+        for fields in csv.reader(infile):
+            if not fields:
+                continue
             to_replica = int(fields[0])
             table = table_from_column_prefix(fields[1])
-            indexes[to_replica].append([table, fields[1:]])
+            indexes[to_replica].append(Index(table, ','.join(fields[1:])))
     
     return indexes
 
 def get_routes(path: str) -> list[int]:
     routes = None
 
-    with open(path, 'r') as infile:
-        table = infile.readline()
-        routes = table.split(',')
-        routes = [int(r) for r in routes]
+    with open(path, 'r', newline='') as infile:
+        table = next(csv.reader(infile))
+        routes = [int(r) for r in table]
     
     return routes
 
@@ -127,6 +152,9 @@ if __name__ == '__main__':
     config = get_index_config(args.index_config, len(replicas))
     routes = get_routes(args.routing_table)
 
+    if 'load' in PHASES_TO_RUN or 'run' in PHASES_TO_RUN:
+        check_replicas(replicas)
+
     if args.query_streams is None:
         num_query_streams = get_default_query_streams(args.scale_factor)
     else:
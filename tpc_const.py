@@ -41,3 +41,39 @@ QS_ORDER = [
     [3, 7, 14, 15, 6, 5, 21, 20, 18, 10, 4, 16, 19, 1, 13, 9, 8, 17, 11, 12, 22, 2],
     [13, 15, 17, 1, 22, 11, 3, 4, 7, 20, 14, 21, 9, 8, 2, 18, 16, 6, 10, 12, 5, 19]
 ]
+
+
+# column types of the tables written to by refresh function #1, in the order
+# dbgen generates them in (as given by the dss.ddl schema)
+ORDERS_TYPES = ['int4', 'int4', 'bpchar', 'numeric', 'date', 'bpchar', 'bpchar', 'int4', 'varchar']
+LINEITEM_TYPES = [
+    'int4', 'int4', 'int4', 'int4', 'numeric', 'numeric', 'numeric', 'numeric',
+    'bpchar', 'bpchar', 'date', 'date', 'date', 'bpchar', 'bpchar', 'varchar'
+]
+
+# the columns of each table in the order dbgen generates them in (as given by
+# the dss.ddl schema). schema_tables.sql lays the tables out in a different
+# order, so every COPY into them names its columns from here
+TABLE_COLUMNS = {
+    'nation': ['n_nationkey', 'n_name', 'n_regionkey', 'n_comment'],
+    'region': ['r_regionkey', 'r_name', 'r_comment'],
+    'part': [
+        'p_partkey', 'p_name', 'p_mfgr', 'p_brand', 'p_type',
+        'p_size', 'p_container', 'p_retailprice', 'p_comment'
+    ],
+    'supplier': ['s_suppkey', 's_name', 's_address', 's_nationkey', 's_phone', 's_acctbal', 's_comment'],
+    'partsupp': ['ps_partkey', 'ps_suppkey', 'ps_availqty', 'ps_supplycost', 'ps_comment'],
+    'customer': [
+        'c_custkey', 'c_name', 'c_address', 'c_nationkey',
+        'c_phone', 'c_acctbal', 'c_mktsegment', 'c_comment'
+    ],
+    'orders': [
+        'o_orderkey', 'o_custkey', 'o_orderstatus', 'o_totalprice', 'o_orderdate',
+        'o_orderpriority', 'o_clerk', 'o_shippriority', 'o_comment'
+    ],
+    'lineitem': [
+        'l_orderkey', 'l_partkey', 'l_suppkey', 'l_linenumber', 'l_quantity', 'l_extendedprice',
+        'l_discount', 'l_tax', 'l_returnflag', 'l_linestatus', 'l_shipdate', 'l_commitdate',
+        'l_receiptdate', 'l_shipinstruct', 'l_shipmode', 'l_comment'
+    ]
+}